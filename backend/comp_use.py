@@ -2,10 +2,10 @@ import asyncio
 from typing import Optional
 from contextlib import AsyncExitStack
 
-from mcp import ClientSession, StdioServerParameters
+from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
 
-from anthropic import Anthropic
+from anthropic import NOT_GIVEN, AsyncAnthropic
 from dotenv import load_dotenv
 import os
 import argparse
@@ -13,6 +13,12 @@ import sys
 
 load_dotenv()
 
+# Seconds to wait for each MCP server to start and list its tools
+DEFAULT_SERVER_TIMEOUT = 60.0
+
+# Prompt cache breakpoint: the request prefix up to a block marked with this is cached
+CACHE_CONTROL = {"type": "ephemeral"}
+
 # Default system prompt that will be used if none is provided via command line
 DEFAULT_SYSTEM_PROMPT = """
 You are Claude, an AI assistant that can take on specialized roles when instructed. When provided with specific instructions for a role named BUTLER, you will fully embody that role and its capabilities.
@@ -34,18 +40,91 @@ Remember that your primary function is to assist users with computer tasks safel
 Remember that whenever possible, you should always avoid using the mouse, and utilize keyboard shortcuts.
 """
 
+class ToolRegistry:
+    """Tools of all connected servers, indexed by their prefixed name
+
+    Each entry maps the prefixed name to the server's session, the tool's
+    original name and its schema. The Claude tools payload is built along
+    with the index, so a turn only rebuilds it when a server's tools have
+    actually changed. Servers are re-listed one at a time after they send
+    a tools/list_changed notification.
+    """
+
+    def __init__(self):
+        self.sessions = {}  # server name -> session
+        self.entries = {}  # server name -> catalog entries of that server
+        self.stale = set()  # servers whose tools changed since they were listed
+        self.index = {}  # prefixed name -> catalog entry
+        self.claude_tools = []  # tools payload for the Claude API
+
+    def add_server(self, server_name: str, session: ClientSession, tools: list):
+        """Store a server's tool listing; call rebuild() once all servers are added"""
+        self.sessions[server_name] = session
+        self.entries[server_name] = [{ 
+            "name": f"{server_name}_{tool.name}",  # Prefix with server name to avoid conflicts
+            "description": f"[{server_name}] {tool.description}",
+            "input_schema": tool.inputSchema,
+            "original_name": tool.name,
+            "server": server_name,
+            "session": session,
+            "read_only": bool(tool.annotations and tool.annotations.readOnlyHint)
+        } for tool in tools]
+
+    def rebuild(self):
+        """Rebuild the index and the Claude tools payload from the stored listings"""
+        catalog = [tool for entries in self.entries.values() for tool in entries]
+        self.index = {tool["name"]: tool for tool in catalog}
+        # Create Claude-compatible tools list (without server-specific fields)
+        self.claude_tools = [{
+            "name": tool["name"],
+            "description": tool["description"],
+            "input_schema": tool["input_schema"]
+        } for tool in catalog]
+        if self.claude_tools:
+            # Tools come first in the prompt, so this caches all of them
+            self.claude_tools[-1]["cache_control"] = CACHE_CONTROL
+
+    def mark_stale(self, server_name: str):
+        """Re-list the server's tools before the next model call"""
+        self.stale.add(server_name)
+
+    async def refresh(self) -> bool:
+        """Re-list the tools of servers marked stale, returns whether anything changed"""
+        server_names = [name for name in self.stale if name in self.sessions]
+        if not server_names:
+            return False
+        
+        # A change reported while listing marks the server stale again
+        self.stale.difference_update(server_names)
+        responses = await asyncio.gather(*(self.sessions[name].list_tools() for name in server_names))
+        for server_name, response in zip(server_names, responses):
+            print(f"\nRefreshed tools of {server_name} server:", [tool.name for tool in response.tools])
+            self.add_server(server_name, self.sessions[server_name], response.tools)
+        
+        self.rebuild()
+        return True
+
+    def get(self, name: str):
+        """Catalog entry for a prefixed tool name, or None"""
+        return self.index.get(name)
+
+    def catalog(self) -> list:
+        """All catalog entries, in server order"""
+        return list(self.index.values())
+
 class MCPClient:
     def __init__(self, system_prompt: str = None):
         # Initialize session and client objects
         self.sessions = {}  # Dictionary to store multiple sessions
-        self.exit_stack = AsyncExitStack()
-        self.anthropic = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        self.tools = ToolRegistry()  # Tools of all servers by prefixed name
+        self.server_tasks = {}  # Task owning each server connection
+        self.shutdown = asyncio.Event()
+        self.anthropic = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
         # Use the default system prompt if none is provided
         self.system_prompt = system_prompt if system_prompt is not None else DEFAULT_SYSTEM_PROMPT
-        self.available_tools = []
 
-    async def connect_to_server(self, server_identifier: str):
-        """Connect to an MCP server
+    def server_parameters(self, server_identifier: str):
+        """Resolve a server identifier to its name and launch parameters
         
         Args:
             server_identifier: Path to the server script (.py or .js) or a server type identifier ('memory', 'vnc')
@@ -64,7 +143,8 @@ class MCPClient:
                 raise ValueError(f"VNC script not found at {vnc_script_path}")
             
             command = "python"
-            args = [vnc_script_path]
+            # Connect to the VM while the rest of the client starts up
+            args = [vnc_script_path, "--warm-up"]
             server_name = "vnc"
         else:
             # Regular script path
@@ -82,190 +162,314 @@ class MCPClient:
             args=args,
             env=None
         )
+        return server_name, server_params
+
+    async def run_server(self, server_name: str, server_params: StdioServerParameters, ready: asyncio.Future):
+        """Own one server connection for its whole lifetime
+
+        The stdio transport and session are opened and closed in this task,
+        since their anyio cancel scopes must be exited by the task that
+        entered them. ``ready`` gets the session and its tool listing once
+        the server is initialized.
+        """
+        try:
+            async with AsyncExitStack() as stack:
+                stdio, write = await stack.enter_async_context(stdio_client(server_params))
+                session = await stack.enter_async_context(
+                    ClientSession(stdio, write, message_handler=self.message_handler(server_name))
+                )
+                
+                await session.initialize()
+                response = await session.list_tools()
+                ready.set_result((session, response.tools))
+                
+                await self.shutdown.wait()
+        except asyncio.CancelledError:
+            if not ready.done():
+                ready.cancel()
+            raise
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            elif not ready.cancelled():
+                print(f"\nServer {server_name} stopped: {e}")
+
+    def message_handler(self, server_name: str):
+        """Session message handler that watches for tool list changes"""
+        async def handle(message):
+            if isinstance(message, types.ServerNotification) and isinstance(message.root, types.ToolListChangedNotification):
+                # Listing from inside the session's receive loop would deadlock, so refresh later
+                self.tools.mark_stale(server_name)
+        return handle
+
+    async def start_server(self, server_identifier: str, timeout: float = DEFAULT_SERVER_TIMEOUT):
+        """Launch and initialize a server without rebuilding the tool catalog"""
+        server_name, server_params = self.server_parameters(server_identifier)
         
-        stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
-        stdio, write = stdio_transport
-        session = await self.exit_stack.enter_async_context(ClientSession(stdio, write))
-        
-        await session.initialize()
+        ready = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(self.run_server(server_name, server_params, ready))
+        try:
+            session, tools = await asyncio.wait_for(asyncio.shield(ready), timeout)
+        except BaseException as e:
+            # Startup was abandoned, so whatever the task fails with is not news
+            ready.cancel()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            if isinstance(e, asyncio.TimeoutError):
+                raise TimeoutError(f"{server_name} server did not start within {timeout:g}s") from None
+            raise
         
         # Store the session
+        self.server_tasks[server_name] = task
         self.sessions[server_name] = session
-        
-        # List available tools
-        response = await session.list_tools()
-        tools = response.tools
         print(f"\nConnected to {server_name} server with tools:", [tool.name for tool in tools])
         
-        # Update available tools
-        await self.update_available_tools()
+        return server_name, session, tools
+
+    async def connect_to_server(self, server_identifier: str, timeout: float = DEFAULT_SERVER_TIMEOUT):
+        """Connect to an MCP server
         
+        Args:
+            server_identifier: Path to the server script (.py or .js) or a server type identifier ('memory', 'vnc')
+            timeout: Seconds to wait for the server to start and list its tools
+        """
+        server_name, session, tools = await self.start_server(server_identifier, timeout)
+        self.tools.add_server(server_name, session, tools)
+        self.tools.rebuild()
         return server_name
 
-    async def connect_to_multiple_servers(self, server_identifiers: list):
-        """Connect to multiple MCP servers
+    async def connect_to_multiple_servers(self, server_identifiers: list, timeout: float = DEFAULT_SERVER_TIMEOUT):
+        """Connect to multiple MCP servers concurrently
+        
+        A server that fails or times out is reported and skipped, the others
+        stay connected.
         
         Args:
             server_identifiers: List of server identifiers (paths or types)
+            timeout: Seconds to wait for each server to start and list its tools
         """
-        for server_id in server_identifiers:
-            await self.connect_to_server(server_id)
+        results = await asyncio.gather(
+            *(self.start_server(server_id, timeout) for server_id in server_identifiers),
+            return_exceptions=True
+        )
+        # Add servers in the order they were given, not the order they came up
+        for server_id, result in zip(server_identifiers, results):
+            if isinstance(result, BaseException):
+                print(f"\nFailed to connect to {server_id} server: {result}")
+            else:
+                self.tools.add_server(*result)
+        
+        if not self.sessions:
+            raise RuntimeError("Could not connect to any MCP server")
+        
+        # Build the catalog once from the listings fetched at startup
+        self.tools.rebuild()
     
     async def update_available_tools(self):
         """Update the list of available tools from all connected servers"""
-        all_tools = []
-        
-        for server_name, session in self.sessions.items():
-            response = await session.list_tools()
-            server_tools = [{ 
-                "name": f"{server_name}_{tool.name}",  # Prefix with server name to avoid conflicts
-                "description": f"[{server_name}] {tool.description}",
-                "input_schema": tool.inputSchema,
-                "original_name": tool.name,
-                "server": server_name
-            } for tool in response.tools]
-            
-            all_tools.extend(server_tools)
-        
-        self.available_tools = all_tools
-        return self.available_tools
+        for server_name in self.sessions:
+            self.tools.mark_stale(server_name)
+        await self.tools.refresh()
+        return self.tools.catalog()
 
     async def get_available_tools(self):
         """Get the list of available tools from all connected servers"""
         if not self.sessions:
             raise ValueError("No sessions initialized. Call connect_to_server first.")
             
-        if not self.available_tools:
-            await self.update_available_tools()
-            
-        return self.available_tools
+        await self.tools.refresh()
+        return self.tools.catalog()
+
+    def format_tool_result(self, content) -> list:
+        """Convert MCP tool result content into Claude content blocks"""
+        blocks = []
+        for item in content:
+            if item.type == "image":
+                # Pass images through so the model can see them
+                blocks.append({
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": item.mimeType,
+                        "data": item.data
+                    }
+                })
+            elif item.type == "text":
+                blocks.append({"type": "text", "text": item.text})
+            else:
+                blocks.append({"type": "text", "text": str(item)})
+        return blocks
+
+    def summarize_tool_result(self, blocks: list) -> str:
+        """Short printable version of a tool result, without image data"""
+        return " ".join(
+            block["text"] if block["type"] == "text" else f"<{block['source']['media_type']} image>"
+            for block in blocks
+        )
+
+    def dispatch_tool(self, tool_use, pending: dict, transcript: list) -> asyncio.Task:
+        """Start a tool call without letting it overtake calls it depends on
+
+        Calls to different servers run concurrently. On the same server a
+        read-only call only waits for the last call that changes state, while
+        a call that changes state waits for every call before it.
+        """
+        tool_info = self.tools.get(tool_use.name)
+        server_name = tool_info["server"] if tool_info else None
+        read_only = tool_info["read_only"] if tool_info else True
+
+        last_write, reads = pending.get(server_name, (None, []))
+        earlier = [last_write] if last_write else []
+        if not read_only:
+            earlier += reads
+
+        task = asyncio.create_task(
+            self.call_tool(tool_use.name, tool_info, tool_use.input, transcript, earlier)
+        )
+        pending[server_name] = (last_write, reads + [task]) if read_only else (task, [])
+        return task
+
+    async def call_tool(self, tool_name: str, tool_info: dict, tool_args: dict, transcript: list,
+                        earlier: list = ()):
+        """Run one tool call on its server and return the tool_result content"""
+        if earlier:
+            await asyncio.wait(earlier)
+
+        if not tool_info:
+            error_msg = f"Tool {tool_name} not found"
+            self.report(transcript, f"[Error: {error_msg}]")
+            return f"Error: {error_msg}"
+
+        # Get the server and original tool name
+        server_name = tool_info["server"]
+        original_tool_name = tool_info["original_name"]
+
+        # Execute tool call on the appropriate server
+        try:
+            result = await tool_info["session"].call_tool(original_tool_name, tool_args)
+            result_content = self.format_tool_result(result.content)
+
+            # Log the tool call and result
+            self.report(transcript, f"[Calling {server_name} tool {original_tool_name} with args {tool_args}]")
+            self.report(transcript, f"[Tool result: {self.summarize_tool_result(result_content)}]")
+            return result_content
+        except Exception as e:
+            error_msg = f"Error calling tool {tool_name}: {str(e)}"
+            self.report(transcript, f"[Error: {error_msg}]")
+            return f"Error: {error_msg}"
+
+    def report(self, transcript: list, line: str):
+        """Print a line as it happens and keep it for the returned transcript"""
+        print(line, flush=True)
+        transcript.append(line)
 
     async def process_query(self, query: str) -> str:
-        """Process a query using Claude and available tools"""
+        """Process a query using Claude and available tools
+
+        Responses are streamed: text is printed as it arrives and each tool
+        call starts as soon as its block is complete, while the rest of the
+        response is still streaming in. All results of a turn go back to
+        Claude in a single message.
+
+        The tools, the system prompt and the query are cached, and a rolling
+        cache breakpoint follows the end of the conversation, so each turn
+        only pays full price for what the previous turn added.
+        """
+        prompt_block = {"type": "text", "text": query, "cache_control": CACHE_CONTROL}
         messages = [
             {
                 "role": "user",
-                "content": query
+                "content": [prompt_block]
             }
         ]
+        system = [{"type": "text", "text": self.system_prompt, "cache_control": CACHE_CONTROL}] if self.system_prompt else NOT_GIVEN
+        rolling_block = prompt_block  # Block carrying the rolling cache breakpoint
 
         # Make sure we have the available tools
-        if not self.available_tools:
-            await self.get_available_tools()
+        tools = await self.get_available_tools()
         
-        print(f"Available tools: {[tool['name'] for tool in self.available_tools]}")
-
-        # Create Claude-compatible tools list (without server-specific fields)
-        claude_tools = [{
-            "name": tool["name"],
-            "description": tool["description"],
-            "input_schema": tool["input_schema"]
-        } for tool in self.available_tools]
-
-        # Initial Claude API call
-        response = self.anthropic.messages.create(
-            model="claude-3-7-sonnet-20250219",
-            max_tokens=1000,
-            messages=messages,
-            tools=claude_tools,
-            system=self.system_prompt
-        )
+        print(f"Available tools: {[tool['name'] for tool in tools]}")
 
         # Process response and handle tool calls
         final_text = []
-        tool_call_count = 0
         
         while True:
+            tool_calls = []  # (tool_use block, task) in response order
+            pending = {}
+
+            # Pick up tools that changed since the last turn
+            await self.tools.refresh()
+
+            # Move the rolling breakpoint to the end of the previous turn, keeping
+            # within the API's limit of four breakpoints
+            if rolling_block is not prompt_block:
+                del rolling_block["cache_control"]
+            rolling_block = messages[-1]["content"][-1]
+            rolling_block["cache_control"] = CACHE_CONTROL
+
+            try:
+                async with self.anthropic.messages.stream(
+                    model="claude-3-7-sonnet-20250219",
+                    max_tokens=1000,
+                    messages=messages,
+                    tools=self.tools.claude_tools,
+                    system=system
+                ) as stream:
+                    async for event in stream:
+                        if event.type == "text":
+                            print(event.text, end="", flush=True)
+                        elif event.type == "content_block_stop":
+                            if event.content_block.type == "text":
+                                print(flush=True)
+                                final_text.append(event.content_block.text)
+                            elif event.content_block.type == "tool_use":
+                                # Start the tool while the rest of the response streams in
+                                tool_use = event.content_block
+                                tool_calls.append((tool_use, self.dispatch_tool(tool_use, pending, final_text)))
+                    response = await stream.get_final_message()
+            except BaseException:
+                for _, task in tool_calls:
+                    task.cancel()
+                raise
+
+            usage = response.usage
+            print(f"[Tokens: {usage.input_tokens} input, {usage.cache_read_input_tokens or 0} cache read, "
+                  f"{usage.cache_creation_input_tokens or 0} cache write, {usage.output_tokens} output]")
+
             assistant_message = {"role": "assistant", "content": []}
-            has_tool_calls = False
-            
             for content in response.content:
                 if content.type == 'text':
-                    final_text.append(content.text)
                     assistant_message["content"].append({"type": "text", "text": content.text})
                 elif content.type == 'tool_use':
-                    has_tool_calls = True
-                    tool_name = content.name
-                    tool_args = content.input
-                    tool_call_count += 1
-                    tool_id = f"call_{tool_call_count}"
-                    
-                    # Find the tool in our available tools
-                    tool_info = next((t for t in self.available_tools if t["name"] == tool_name), None)
-                    
-                    if not tool_info:
-                        error_msg = f"Tool {tool_name} not found"
-                        final_text.append(f"[Error: {error_msg}]")
-                        assistant_message["content"].append({"type": "text", "text": f"Error: {error_msg}"})
-                        continue
-                    
                     # Add tool call to assistant message with required id field
                     assistant_message["content"].append({
                         "type": "tool_use",
-                        "id": tool_id,
-                        "name": tool_name,
-                        "input": tool_args
+                        "id": content.id,
+                        "name": content.name,
+                        "input": content.input
                     })
-                    
-                    # Get the server and original tool name
-                    server_name = tool_info["server"]
-                    original_tool_name = tool_info["original_name"]
-                    
-                    # Execute tool call on the appropriate server
-                    try:
-                        result = await self.sessions[server_name].call_tool(original_tool_name, tool_args)
-                        
-                        # Log the tool call and result
-                        final_text.append(f"[Calling {server_name} tool {original_tool_name} with args {tool_args}]")
-                        final_text.append(f"[Tool result: {result.content}]")
-                        
-                        # Add assistant message with tool call to conversation
-                        messages.append(assistant_message)
-                        
-                        # Add tool result as user message with tool_result format
-                        messages.append({
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "tool_result",
-                                    "tool_use_id": tool_id,
-                                    "content": result.content
-                                }
-                            ]
-                        })
-                    except Exception as e:
-                        error_msg = f"Error calling tool {tool_name}: {str(e)}"
-                        final_text.append(f"[Error: {error_msg}]")
-                        
-                        # Add error as tool result
-                        messages.append(assistant_message)
-                        messages.append({
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "tool_result",
-                                    "tool_use_id": tool_id,
-                                    "content": f"Error: {error_msg}"
-                                }
-                            ]
-                        })
-                    
-                    break
             
-            # If no tool calls or we've processed all content, add the assistant message
-            if not has_tool_calls:
+            # If there were no tool calls, this was the final answer
+            if not tool_calls:
                 if assistant_message["content"]:
                     messages.append(assistant_message)
                 break
             
-            # Get next response from Claude for the next iteration
-            response = self.anthropic.messages.create(
-                model="claude-3-7-sonnet-20250219",
-                max_tokens=1000,
-                messages=messages,
-                tools=claude_tools,
-                system=self.system_prompt
-            )
+            results = await asyncio.gather(*(task for _, task in tool_calls))
+
+            # Add assistant message with tool calls and all of their results to the conversation
+            messages.append(assistant_message)
+            messages.append({
+                "role": "user",
+                "content": [
+                    {
+                        "type": "tool_result",
+                        "tool_use_id": tool_use.id,
+                        "content": result_content
+                    }
+                    for (tool_use, _), result_content in zip(tool_calls, results)
+                ]
+            })
 
         return "\n".join(final_text)
 
@@ -314,7 +518,7 @@ class MCPClient:
             initial_message += f"- {tool['name']}: {tool['description']}\n"
         
         print("\nSending tool information to Claude...")
-        response = await self.process_query(initial_message)
+        await self.process_query(initial_message)
         print("\nClaude is ready to use the tools.")
         
         while True:
@@ -324,15 +528,16 @@ class MCPClient:
                 if query.lower() == 'quit':
                     break
                     
-                response = await self.process_query(query)
-                print("\n" + response)
+                # The response is printed as it streams in
+                await self.process_query(query)
                     
             except Exception as e:
                 print(f"\nError: {str(e)}")
 
     async def cleanup(self):
         """Clean up resources"""
-        await self.exit_stack.aclose()
+        self.shutdown.set()
+        await asyncio.gather(*self.server_tasks.values(), return_exceptions=True)
 
 async def main():
     parser = argparse.ArgumentParser(description="Computer Use Agent")
@@ -341,6 +546,7 @@ async def main():
     parser.add_argument("--system-prompt", help="System prompt for Claude (overrides default)")
     parser.add_argument("--system-prompt-file", "-f", help="File containing system prompt for Claude (overrides default)")
     parser.add_argument("--no-system-prompt", "-n", action="store_true", help="Don't use any system prompt")
+    parser.add_argument("--server-timeout", type=float, default=DEFAULT_SERVER_TIMEOUT, help=f"Seconds to wait for each server to start (default {DEFAULT_SERVER_TIMEOUT:g})")
     parser.add_argument("--interactive", "-i", action="store_true", help="Run in interactive chat mode")
     
     args = parser.parse_args()
@@ -362,7 +568,7 @@ async def main():
     client = MCPClient(system_prompt=system_prompt)
     
     try:
-        await client.connect_to_multiple_servers(args.server_scripts)
+        await client.connect_to_multiple_servers(args.server_scripts, timeout=args.server_timeout)
         
         if args.interactive:
             # Run in interactive mode
@@ -375,8 +581,7 @@ async def main():
                 sys.exit(1)
             
             print(f"\nExecuting task: {args.task}")
-            response = await client.execute_task(args.task)
-            print("\n" + response)
+            await client.execute_task(args.task)
     finally:
         await client.cleanup()
 
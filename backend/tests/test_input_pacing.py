@@ -0,0 +1,47 @@
+import asyncio
+
+import vnc_mcp
+from vnc_bench import FakeVNCServer
+
+
+class SlowTypist(FakeVNCServer):
+    """Fake server that works through input events one at a time, like a busy VM echoing keystrokes"""
+    def __init__(self, per_event: float, **kwargs):
+        super().__init__(**kwargs)
+        self.per_event = per_event
+        self.busy_until = 0.0
+
+    def process(self, handler, *args):
+        loop = asyncio.get_running_loop()
+        self.busy_until = max(self.busy_until, loop.time()) + self.per_event
+        loop.call_at(self.busy_until, handler, *args)
+
+
+async def type_on_slow_server(text: str, per_event: float):
+    server = SlowTypist(per_event, width=320, height=200)
+    port = await server.start()
+    manager = vnc_mcp.VNCManager()
+    try:
+        await manager.register_connection("slow", f"vnc://u:p@127.0.0.1:{port}")
+        conn = await manager.get_connection("slow")
+        await conn.framebuffer.snapshot()  # First full frame
+        await asyncio.sleep(vnc_mcp.PACING_QUIET_TIME)
+        budget_before = conn.pacer.char_budget()
+        await vnc_mcp.send_text(conn.client, text, pacer=conn.pacer)
+        return server.cursor, budget_before, conn.pacer
+    finally:
+        await manager.cleanup()
+        server.server.close()
+
+
+def test_pacer_waits_for_per_character_echo():
+    # Press and release take 10ms each, 20ms per character against a 12ms starting estimate
+    text = "a" * (2 * vnc_mcp.TYPING_GROUP_SIZE)
+    drawn, budget_before, pacer = asyncio.run(type_on_slow_server(text, 0.01))
+
+    # Every chunk was drawn before the next one was sent
+    assert drawn == len(text)
+    # The pacer slowed down to the real per-character latency instead of speeding up
+    assert pacer.char_budget() >= budget_before
+    assert pacer.char_latency > vnc_mcp.TYPING_DELAY_MS / 1000
+    assert pacer.reflected == 2
@@ -0,0 +1,22 @@
+import vnc_mcp
+
+
+def test_read_past_the_end_has_nothing_available():
+    buffer = vnc_mcp.OutputBuffer()
+    buffer.write(b"hello")
+
+    result = buffer.read(10)
+    assert result["data"] == ""
+    assert result["dropped"] == 0
+    assert result["available"] == 0
+
+
+def test_read_skips_dropped_output():
+    buffer = vnc_mcp.OutputBuffer(limit=4)
+    buffer.write(b"abcdefgh")
+
+    result = buffer.read(0, max_bytes=2)
+    assert result["data"] == "ef"
+    assert result["offset"] == 4
+    assert result["dropped"] == 4
+    assert result["available"] == 2
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import comp_use
+import terminal_client
+import vnc_mcp
+
+
+@pytest.fixture(scope="module")
+def vnc_tools():
+    """Tool listing of the VNC server, with its real annotations"""
+    # create_mcp_server() sets up its default connection on the current event loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(vnc_mcp.create_mcp_server().list_tools())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class RecordingSession:
+    """Stands in for a ClientSession, recording when each call starts and ends"""
+    def __init__(self, durations):
+        self.durations = durations
+        self.events = []
+
+    async def call_tool(self, name, args):
+        self.events.append(("start", name))
+        await asyncio.sleep(self.durations.get(name, 0.01))
+        self.events.append(("end", name))
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=name)])
+
+
+def dispatch(module, tools, names, durations):
+    """Dispatch tool calls on the vnc server the way one model turn does, returns the call events"""
+    async def run():
+        client = module.MCPClient()
+        session = RecordingSession(durations)
+        client.tools.add_server("vnc", session, tools)
+        client.tools.rebuild()
+        pending = {}
+        tasks = [client.dispatch_tool(SimpleNamespace(name=f"vnc_{name}", input={}), pending, [])
+                 for name in names]
+        await asyncio.gather(*tasks)
+        return session.events
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("module", [comp_use, terminal_client])
+def test_click_wait_screenshot_run_in_order(module, vnc_tools):
+    names = ["vnc_click", "vnc_wait_for_stable", "vnc_screenshot"]
+    events = dispatch(module, vnc_tools, names, {"vnc_wait_for_stable": 0.1})
+    assert events == [(kind, name) for name in names for kind in ("start", "end")]
+
+
+@pytest.mark.parametrize("module", [comp_use, terminal_client])
+def test_wait_for_change_orders_later_reads(module, vnc_tools):
+    names = ["vnc_key", "vnc_wait_for_change", "vnc_screenshot_region"]
+    events = dispatch(module, vnc_tools, names, {"vnc_wait_for_change": 0.1})
+    assert events == [(kind, name) for name in names for kind in ("start", "end")]
+
+
+@pytest.mark.parametrize("module", [comp_use, terminal_client])
+def test_read_only_calls_overlap(module, vnc_tools):
+    names = ["vnc_screenshot_region", "vnc_identify_screen"]
+    events = dispatch(module, vnc_tools, names, {})
+    assert events[:2] == [("start", "vnc_screenshot_region"), ("start", "vnc_identify_screen")]